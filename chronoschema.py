@@ -1,17 +1,84 @@
 import os
 import re
+import errno
+import mmap
+import queue
 import shutil
+import tempfile
+import threading
 import pyodbc
 import urllib3
+import ahocorasick
 import sqlalchemy as sql
 import mssqlscripter.main as scripter
 from glob import glob
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import defaultdict
+from functools import lru_cache, partial
 from datetime import datetime
 import unicodedata
 import click
 
 urllib3.disable_warnings()
 
+_SLUG_STRIP_RE = re.compile(r'[^\w\s-]')
+_SLUG_DASH_RE  = re.compile(r'[-\s]+')
+
+WRITE_BUFFER_SIZE = 1 << 20
+BATCH_GROUP_SIZE  = 32
+SCHEMA_WORKERS    = 8
+PREFETCH_BATCHES  = 64
+
+# Batches T-SQL wants alone (CREATE VIEW/PROCEDURE/etc. must start their batch, database statements can't run inside
+# a transaction) or whose meaning would change once merged with others (variable scope, early RETURN/GOTO, XACT_ABORT
+# which grouped batches turn on for themselves).
+_STANDALONE_BATCH_RE = re.compile(
+    r"\b(?:(?:CREATE|ALTER)\s+(?:OR\s+ALTER\s+)?(?:PROC|PROCEDURE|FUNCTION|TRIGGER|VIEW|SCHEMA|DEFAULT|RULE|DATABASE)|DROP\s+DATABASE|DECLARE|RETURN|GOTO|XACT_ABORT)\b",
+    re.IGNORECASE,
+)
+_XACT_ABORT_RE  = re.compile(r"\bXACT_ABORT\b", re.IGNORECASE)
+_XACT_ABORT_GET = "SELECT CAST(@@OPTIONS & 16384 AS bit);"
+_XACT_ABORT_OFF = "\nSET XACT_ABORT OFF;"
+_GROUP_BEGIN   = "SET XACT_ABORT ON;\nBEGIN TRANSACTION;\n"
+_GROUP_END     = "COMMIT TRANSACTION;"
+_GROUP_CLEANUP = "IF @@TRANCOUNT > 0 ROLLBACK TRANSACTION;"
+_SAVEPOINT          = "IF @@TRANCOUNT = 0 BEGIN TRANSACTION;\nSAVE TRANSACTION batch_group;"
+_SAVEPOINT_ROLLBACK = "ROLLBACK TRANSACTION batch_group;"
+
+# Statements SQL Server refuses to run inside a transaction, wherever they are ("IF DB_ID('x') IS NULL CREATE DATABASE").
+# Only looked for once comments, string literals and quoted identifiers are masked, _NON_TRANSACTIONAL_HINT_RE being a
+# quick pre-check.
+_NON_TRANSACTIONAL_RE = re.compile(
+    rb"\b(?:(?:CREATE|ALTER|DROP)\s+(?:DATABASE|FULLTEXT\s+(?:CATALOG|INDEX))|(?:BACKUP|RESTORE)\s+(?:DATABASE|LOG)|RECONFIGURE)\b",
+    re.IGNORECASE,
+)
+_NON_TRANSACTIONAL_HINT_RE = re.compile(rb"\b(?:DATABASE|FULLTEXT|BACKUP|RESTORE|RECONFIGURE)\b", re.IGNORECASE)
+_SQL_NOISE_RE              = re.compile(rb"(--[^\n]*|/\*.*?\*/)|N?'(?:[^']|'')*'|\[[^\]]*\]|\"(?:[^\"]|\"\")*\"", re.DOTALL)
+
+# Session options a batch sets, and batches made of nothing else ("SET ANSI_NULLS ON", "SET QUOTED_IDENTIFIER ON"...)
+# as scripted ahead of every object.
+_SET_OPTION_RE       = re.compile(r"\bSET\s+(\w+(?:\s*,\s*\w+)*)\s+(ON|OFF)\b", re.IGNORECASE)
+# Whitespace is only consumed in one place, possessively, so batches that don't match fail fast.
+_SET_OPTIONS_ONLY_RE = re.compile(r"\s*+(?:SET\s++\w++(?:\s*+,\s*+\w++)*+\s++(?:ON|OFF)\b(?:\s*+;)?+\s*+)++", re.IGNORECASE)
+# Options that don't change, and aren't changed by, any other option. ANSI_DEFAULTS for one turns several of them off.
+_SIMPLE_SET_OPTIONS  = frozenset({"ANSI_NULLS", "ANSI_PADDING", "QUOTED_IDENTIFIER", "CONCAT_NULL_YIELDS_NULL", "NOCOUNT"})
+
+# Any multi-part object name mention in a script, bracketed or not, and the names (schema defaulting to dbo when left
+# out) that are most likely a dependency of the scripted object. Only their last two parts, schema and object, are used.
+_NAME_PART      = r"(?:\[[^\]]+\]|[^\W\d][\w@#$]*)"
+_NAME_PARTS_RE  = re.compile(r"\[([^\]]+)\]|([^.\[\]]+)")
+_OBJECT_NAME_RE = re.compile(fr"(?<![\w@#$])((?:{_NAME_PART}\.){{1,3}}{_NAME_PART})")
+_REFERENCE_RE   = re.compile(fr"\b(?:REFERENCES|FROM|JOIN|ON)\s+((?:{_NAME_PART}\.){{0,3}}{_NAME_PART})", re.IGNORECASE)
+
+# Data seed statements, "INSERT INTO [schema].[table] (columns) VALUES (...), (...)" with nothing but literals as values.
+# Numbers can only be matched one way, possessively, or failing rows would retry every split of their digits.
+_SEED_NUMBER    = r"[-+]?+(?:\d++(?:\.\d*+)?+|\.\d++)(?:E[-+]?+\d++)?+"
+_SEED_LITERAL   = fr"N?'(?:[^']|'')*'|NULL|{_SEED_NUMBER}"
+_SEED_INSERT_RE = re.compile(r"\s*INSERT\s+(?:INTO\s+)?((?:\[[^\]]+\]|\w+)(?:\.(?:\[[^\]]+\]|\w+)){0,2})\s*\(([^)]+)\)\s*VALUES", re.IGNORECASE)
+_SEED_ROW_RE    = re.compile(fr"\s*\(\s*((?:{_SEED_LITERAL})(?:\s*,\s*(?:{_SEED_LITERAL}))*)\s*\)\s*(,?)", re.IGNORECASE)
+_SEED_VALUE_RE  = re.compile(fr"N?'((?:[^']|'')*)'|NULL|({_SEED_NUMBER})", re.IGNORECASE)
+_SEED_END_RE    = re.compile(r"\s*;?\s*")
+
 def slugify(value:str, allow_unicode:bool=False):
     """
     Taken from https://github.com/django/django/blob/master/django/utils/text.py
@@ -23,50 +90,600 @@ def slugify(value:str, allow_unicode:bool=False):
     value = str(value)
     if allow_unicode:
         value = unicodedata.normalize('NFKC', value)
-    else:
+    elif not value.isascii():
         value = unicodedata.normalize('NFKD', value).encode('ascii', 'ignore').decode('ascii')
-    value = re.sub(r'[^\w\s-]', '', value.lower())
-    return re.sub(r'[-\s]+', '-', value).strip('-_')
+    value = value.lower()
+    if value.isascii() and value.isalnum():
+        return value
+    value = _SLUG_STRIP_RE.sub('', value)
+    return _SLUG_DASH_RE.sub('-', value).strip('-_')
+
+@lru_cache(maxsize=None)
+def sql_driver() -> str:
+    """
+    Name of the installed SQL Server ODBC driver, looked up once as pyodbc.drivers() scans the system on every call.
+    """
+    return [x for x in pyodbc.drivers() if x.endswith('SQL Server')][0]
 
-@click.group()
-def cli():
-    pass
+@lru_cache(maxsize=None)
+def sql_conn_url(server:str) -> sql.engine.URL:
+    """
+    URL to the master database of a server using a trusted connection, built once per server.
+    """
+    sql_conn_str           = fr"Driver={{{sql_driver()}}}; Server={server};Database=master;Trusted_Connection=yes;"
+    return sql.engine.URL.create("mssql+pyodbc", query={"odbc_connect": sql_conn_str})
 
-@cli.command()
-@click.option('-s', '--sources', type=str, help='List of source adresses in a [server].[database] format.', multiple=True)
-@click.option('-g', '--generate_creation_migrations', type=bool, help='If a database creation script sould be created in the migrations folder.', default=False)
-@click.option('-o', '--overwrite', type=bool, help='If existing schema scripts should be replaced by the newly generated ones', default=False)
-@click.option('-d', '--base_dir', type=str, help='Directory where the schema and migrations should reside. Current working dir by default.', default='')
-def from_db(sources: list[str], generate_creation_migrations:bool=False, overwrite:bool=False, base_dir:str=""):
+def create_sql_engine(server:str, pool_size:int=5, autocommit:bool=True):
     """
-    Generates the database schema for each of the "[server].[database]" items passed to the function.
-    Optionally also generates the inital database creation script in the migrations folder.
+    Creates an engine against the master database of a server, in autocommit mode unless stated otherwise.
     """
-    #TODO: Add a file creation order marker to filenames, as it's relevant to the execution order when spawning DBs from the scripted schemas.
-    #TODO: Make it so the creation order marks are base os file contents and proper dependency tracking.
+    return sql.create_engine(sql_conn_url(server), connect_args = {"autocommit":autocommit}, pool_size=pool_size)
 
-    sources = list(sources)
-    
-    if not base_dir:
-        base_dir = os.getcwd()
+def read_text(path:str) -> str:
+    """
+    Reads an utf-8 text file through a memory map, decoding straight from the OS page cache instead of a copy of it.
+    Newlines are normalized to "\\n", same as reading in text mode.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            text = str(mm, "utf-8")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+def write_text(path:str, text:str):
+    """
+    Writes an utf-8 text file through a 1 MiB buffered temporary file, swapped in place with a single os.replace.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8", buffering=WRITE_BUFFER_SIZE) as f:
+        _ = f.write(text)
+    os.replace(tmp_path, path)
+
+def iter_batches(path:str):
+    """
+    Yields the GO-separated batches of a script one at a time, scanning its memory map for "GO" lines so only the
+    batch about to be executed gets copied and decoded. Anything after the last GO is ignored.
+    Batches come as (line, batch) pairs, line being where the batch starts in the script, counting from 1.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # go is the offset of the next line starting with "GO", -1 once there are none left.
+            start = 0
+            line  = 1
+            go = 0 if mm[:2] == b"GO" else mm.find(b"\nGO") + 1 or -1
+            while go >= 0:
+                end = go + 2
+                if mm[end:end+1] == b"\n":
+                    end += 1
+                elif mm[end:end+2] == b"\r\n":
+                    end += 2
+                else:
+                    go = mm.find(b"\nGO", go) + 1 or -1
+                    continue
+
+                batch = str(mm[start:go], "utf-8")
+                if batch.strip():
+                    yield line, batch
+                line += batch.count("\n") + 1
+                start = end
+                go = mm.find(b"\nGO", end - 1) + 1 or -1
+
+def parse_seed_insert(batch:str) -> tuple[str, list[tuple]]|None:
+    """
+    Parses a batch made only of literal INSERT ... VALUES statements into one table and column list.
+    Returns the equivalent "?" parameterized statement along with its rows, or None for any other kind of batch.
+    Numbers are kept as text, leaving their conversion to the column's type up to the server as with the literals.
+    """
+    statement:str|None = None
+    rows:list[tuple] = []
+    pos = 0
+    while pos < len(batch):
+        insert = _SEED_INSERT_RE.match(batch, pos)
+        if not insert:
+            return None
+        columns = insert.group(2).split(",")
+        insert_statement = fr"INSERT INTO {insert.group(1)} ({",".join(column.strip() for column in columns)}) VALUES ({",".join("?" * len(columns))})"
+        if statement and insert_statement != statement:
+            return None
+        statement = insert_statement
+
+        pos = insert.end()
+        while row := _SEED_ROW_RE.match(batch, pos):
+            values = [
+                value.group(1).replace("''", "'") if value.group(1) is not None else value.group(2)
+                for value in _SEED_VALUE_RE.finditer(row.group(1))
+            ]
+            if len(values) != len(columns):
+                return None
+            rows.append(tuple(values))
+            pos = row.end()
+            if not row.group(2):
+                break
+        else:
+            return None
+        pos = _SEED_END_RE.match(batch, pos).end()
+    return (statement, rows) if statement else None
+
+def iter_files(root:str):
+    """
+    Yields an os.DirEntry for every file under root, walking it with os.scandir and an explicit stack.
+    Each directory is fully listed before its files are yielded, so they can be moved or deleted while iterating.
+    """
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            entries = list(it)
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            else:
+                yield entry
+
+def prefetch(iterable, size:int=PREFETCH_BATCHES):
+    """
+    Iterates over an iterable from a background thread, keeping up to size items read ahead of the consumer.
+    Errors raised while iterating are re-raised to the consumer, and the thread stops once the consumer is done.
+    """
+    items = queue.Queue(maxsize=size)
+    done  = threading.Event()
+    end   = object()
+
+    def put(item) -> bool:
+        while not done.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception as exc:
+            _ = put((end, exc))
+            return
+        _ = put((end, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item, exc = items.get()
+            if item is end:
+                if exc:
+                    raise exc
+                return
+            yield item
+    finally:
+        done.set()
+
+def requires_autocommit(path:str) -> bool:
+    """
+    Checks, without decoding it, if a script holds statements that can't run inside a transaction.
+    Comments are masked as line breaks and literals or quoted identifiers as "_", so none of them can match.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return False
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if not _NON_TRANSACTIONAL_HINT_RE.search(mm):
+                return False
+            code = _SQL_NOISE_RE.sub(lambda match: b"\n" if match.group(1) else b"_", mm)
+    return _NON_TRANSACTIONAL_RE.search(code) is not None
+
+def group_batches(batches, size:int=BATCH_GROUP_SIZE):
+    """
+    Groups consecutive GO-separated batches so they can be sent to the server in a single round-trip.
+    Takes iter_batches' (line, batch) pairs and yields (batches, seed) pairs. Batches that have to run by themselves
+    come alone, and consecutive data seed batches into the same table come together with their merged
+    parse_seed_insert result as seed, which is None otherwise.
+    """
+    group:list[tuple[int, str]] = []
+    seed:tuple[str, list[tuple]]|None = None
+    for line, batch in batches:
+        batch_seed = parse_seed_insert(batch)
+        if batch_seed:
+            if group and (not seed or seed[0] != batch_seed[0]):
+                yield group, seed
+                group, seed = [], None
+            if seed:
+                seed[1].extend(batch_seed[1])
+            else:
+                seed = batch_seed
+            group.append((line, batch))
+        elif _STANDALONE_BATCH_RE.search(batch):
+            if group:
+                yield group, seed
+                group, seed = [], None
+            yield [(line, batch)], None
+        else:
+            if seed:
+                yield group, seed
+                group, seed = [], None
+            group.append((line, batch))
+            if len(group) >= size:
+                yield group, None
+                group = []
+    if group:
+        yield group, seed
+
+def track_settings(settings:dict[str, str], batch:str) -> bool:
+    """
+    Updates the session options known to be in effect with the ones set by a batch.
+    Returns True if the batch does nothing but set options to the values they already have, so it can be skipped.
+    Only _SIMPLE_SET_OPTIONS are tracked, setting any other option forgets all of them as it may have changed them too.
+    Options set alongside other statements are forgotten, they may be scoped to a procedure or skipped over by control
+    flow.
+    """
+    options_only = _SET_OPTIONS_ONLY_RE.fullmatch(batch) is not None
+    redundant    = options_only
+    for match in _SET_OPTION_RE.finditer(batch):
+        value = match[2].upper()
+        for option in match[1].upper().split(","):
+            option = option.strip()
+            if option not in _SIMPLE_SET_OPTIONS:
+                settings.clear()
+                redundant = False
+            elif not options_only:
+                _ = settings.pop(option, None)
+                redundant = False
+            else:
+                if settings.get(option) != value:
+                    redundant = False
+                settings[option] = value
+    return redundant
+
+def iter_migration_batches(paths:list[str]):
+    """
+    Yields the batches of a list of migration scripts, in order. Each script comes as an (index, autocommit) header,
+    its iter_batches (line, batch) pairs, and a None end marker, see take_script.
+    autocommit tells if the script holds statements that can't run inside a transaction, see requires_autocommit.
+    The end marker comes before the next script is opened, so its errors can only surface once the previous one is done.
+    """
+    for i, path in enumerate(paths):
+        yield i, requires_autocommit(path)
+        yield from iter_batches(path)
+        yield None
+
+def take_script(items):
+    """
+    Yields the (line, batch) pairs of an iter_migration_batches stream up to the end of the current script.
+    """
+    for item in items:
+        if item is None:
+            return
+        yield item
+
+def run_sql(cursor, statement:str):
+    """
+    Executes a statement on a raw DBAPI cursor, draining every result set so errors raised by later statements surface.
+    """
+    _ = cursor.execute(statement)
+    while cursor.nextset():
+        pass
+
+def xact_abort_enabled(cursor) -> bool:
+    """
+    Checks if XACT_ABORT is on for the cursor's session.
+    """
+    _ = cursor.execute(_XACT_ABORT_GET)
+    return bool(cursor.fetchone()[0])
+
+def execute_batches(connection, batches, path:str, transactional:bool=False) -> int:
+    """
+    Executes iter_batches' (line, batch) pairs over an open connection, up to BATCH_GROUP_SIZE of them per round-trip.
+    Data seed inserts are sent as parameterized rows through pyodbc's fast_executemany instead.
+    Grouped batches run all-or-nothing, if they fail they are retried one by one so the failing batch can be identified.
+    Groups that only repeat session options already set by earlier batches are skipped.
+    Outside of a transaction, groups run with XACT_ABORT on and restore whatever value the script had set before them.
+    When transactional, the connection must be inside a transaction: groups are guarded by savepoints and the first
+    failing batch raises its error, otherwise failures are reported and execution carries on with the next batch.
+    path is the script the batches come from, named in failure reports. Returns how many batches failed.
+    """
+    cursor = connection.connection.cursor()
+    cursor.fast_executemany = True
+    executed = 0
+    failed   = 0
+    settings:dict[str, str] = {}
+    xact_abort = not transactional and xact_abort_enabled(cursor)
+    try:
+        for group, seed in group_batches(batches):
+            if not seed and all([track_settings(settings, batch) for _, batch in group]):
+                executed += len(group)
+                continue
+            try:
+                if transactional and (seed or len(group) > 1):
+                    run_sql(cursor, _SAVEPOINT)
+                if seed:
+                    if not transactional:
+                        run_sql(cursor, _GROUP_BEGIN)
+                    cursor.executemany(*seed)
+                    if not transactional:
+                        run_sql(cursor, _GROUP_END if xact_abort else _GROUP_END + _XACT_ABORT_OFF)
+                elif len(group) == 1:
+                    run_sql(cursor, group[0][1])
+                elif transactional:
+                    run_sql(cursor, "\n;\n".join(batch for _, batch in group))
+                else:
+                    run_sql(cursor, _GROUP_BEGIN + "\n;\n".join(batch for _, batch in group) + "\n;\n" + (_GROUP_END if xact_abort else _GROUP_END + _XACT_ABORT_OFF))
+            except Exception as exc:
+                if len(group) == 1 and not seed:
+                    print(fr"Failed on batch {executed+1} of {path}, starting at line {group[0][0]}!")
+                    print(exc)
+                    failed += 1
+                    if transactional:
+                        raise
+                else:
+                    run_sql(cursor, _SAVEPOINT_ROLLBACK if transactional else _GROUP_CLEANUP if xact_abort else _GROUP_CLEANUP + _XACT_ABORT_OFF)
+                    for i, (line, batch) in enumerate(group, executed+1):
+                        try:
+                            run_sql(cursor, batch)
+                        except Exception as exc:
+                            print(fr"Failed on batch {i} of {path}, starting at line {line}!")
+                            print(exc)
+                            failed += 1
+                            if transactional:
+                                raise
+            executed += len(group)
+            # Batches changing XACT_ABORT always come alone, see _STANDALONE_BATCH_RE.
+            if not transactional and _XACT_ABORT_RE.search(group[0][1]):
+                xact_abort = xact_abort_enabled(cursor)
+    finally:
+        cursor.close()
+    return failed
+
+def object_key(name:str) -> tuple[str, str]:
+    """
+    Lowercased (schema, object) of a possibly bracketed, one to four part object name. Schema defaults to dbo.
+    """
+    parts = [bracketed or plain for bracketed, plain in _NAME_PARTS_RE.findall(name)]
+    return (parts[-2] if len(parts) > 1 else "dbo").lower(), parts[-1].lower()
+
+def build_dag(files:list[str]) -> dict[str, dict[str, int]]:
+    """
+    Builds the dependency graph of scripted schema files as {file: {dependency_file: confidence}}.
+    Files are matched to the objects they create through mssql-scripter's "schema.object.Type.sql" naming, and
+    dependencies are found by scanning the scripts for object names, bracketed or not. Database and schema scripts are
+    a certain dependency, explicit references (REFERENCES, FROM, JOIN, ON) a likely one and plain mentions a weak one.
+    """
+    databases:set[str] = set()
+    schemas:dict[str, str] = {}
+    producers:dict[tuple[str, str], str] = {}
+    for file in files:
+        qualified, _, object_type = os.path.splitext(os.path.basename(file))[0].rpartition(".")
+        if object_type == "Database":
+            databases.add(file)
+        elif object_type == "Schema":
+            schemas[qualified.lower()] = file
+        elif "." in qualified:
+            schema, name = qualified.lower().split(".", 1)
+            producers[(schema, name)] = file
+
+    dag:dict[str, dict[str, int]] = {}
+    for file in files:
+        dependencies = dag[file] = {}
+        if file in databases:
+            continue
+        for database in databases:
+            dependencies[database] = 3
+
+        qualified = os.path.splitext(os.path.basename(file))[0].rpartition(".")[0].lower()
+        schema_file = schemas.get(qualified.split(".", 1)[0])
+        if schema_file and schema_file != file:
+            dependencies[schema_file] = 3
+
+        text = read_text(file)
+        for regex, confidence in ((_OBJECT_NAME_RE, 1), (_REFERENCE_RE, 2)):
+            for match in regex.finditer(text):
+                producer = producers.get(object_key(match.group(1)))
+                if producer and producer != file and dependencies.get(producer, 0) < confidence:
+                    dependencies[producer] = confidence
+    return dag
+
+def topological_waves(dag:dict[str, dict[str, int]]) -> list[list[str]]:
+    """
+    Sorts a build_dag graph with Kahn's algorithm, grouping files that don't depend on each other in waves.
+    Dependency cycles are broken by dropping the lowest confidence edge left among the unsorted files.
+    """
+    pending = {file: dict(dependencies) for file, dependencies in dag.items()}
+    dependants:dict[str, set[str]] = defaultdict(set)
+    for file, dependencies in pending.items():
+        for dependency in dependencies:
+            dependants[dependency].add(file)
+
+    waves:list[list[str]] = []
+    ready = [file for file, dependencies in pending.items() if not dependencies]
+    while pending:
+        if not ready:
+            file, dependency = min(
+                ((file, dependency) for file, dependencies in pending.items() for dependency in dependencies),
+                key=lambda edge: (pending[edge[0]][edge[1]], edge),
+            )
+            print(fr"Dependency cycle found, ignoring that {file} depends on {dependency}...")
+            del pending[file][dependency]
+            dependants[dependency].discard(file)
+            if not pending[file]:
+                ready.append(file)
+            continue
+
+        wave, ready = sorted(ready), []
+        for file in wave:
+            del pending[file]
+        for file in wave:
+            for dependant in dependants[file]:
+                del pending[dependant][file]
+                if not pending[dependant]:
+                    ready.append(dependant)
+        waves.append(wave)
+    return waves
+
+def apply_schema_file(sql_engine, path:str) -> int:
+    """
+    Executes a single schema script using a connection from the engine's pool. Returns how many batches failed.
+    """
+    with sql_engine.connect() as connection:
+        print(fr"Executing batches from {path}...")
+        return execute_batches(connection, iter_batches(path), path)
 
-    for source in sources:
-        source_server, source_db    = source.strip("[").strip("]").split("].[")
-        db_stg_dir             = f"{base_dir}\\.stg\\{slugify(source)}"
+def apply_schema_target(sql_engine, target:str, overwrite:bool, base_dir:str) -> int:
+    """
+    Runs the schema scripts of a "[server].[database]" target in dependency order, up to SCHEMA_WORKERS files at a time.
+    Each worker keeps reusing the same pooled connection of the server's engine instead of connecting once per file.
+    Returns how many batches failed, concurrent DDL can also fail by being chosen as a deadlock victim.
+    """
+    target_server, target_db    = target.strip("[").strip("]").split("].[")
 
+    print(fr"Trying to connect to {target_server}...")
 
-        if os.path.isdir(db_stg_dir):
-            shutil.rmtree(db_stg_dir)
+    if overwrite:
+        with sql_engine.connect() as connection:
+            print(fr"Dropping [{target_db}] if it already exists...")
+            _ = connection.execute(sql.text(fr"DROP DATABASE IF EXISTS [{target_db}];"))
+
+    files = [os.path.join(root, file) for root, _, files in os.walk(f"{base_dir}\\schema\\{target_server}\\{target_db}") for file in files]
+    waves = topological_waves(build_dag(files))
+
+    print(fr"Preparing to execute {len(files)} schema scripts on {target}...")
+    failed = 0
+    with ThreadPoolExecutor(max_workers=SCHEMA_WORKERS) as executor:
+        for wave in waves:
+            failed += sum(executor.map(lambda file: apply_schema_file(sql_engine, file), wave))
+    if failed:
+        print(fr"{failed} batches failed on {target}.")
+    return failed
+
+def build_swap_automaton(name_swaps:dict[str, str]) -> ahocorasick.Automaton:
+    """
+    Builds an Aho-Corasick automaton holding every name to be swapped, along with its replacement.
+    """
+    automaton = ahocorasick.Automaton()
+    for source, target in name_swaps.items():
+        if source:
+            _ = automaton.add_word(source, (source, target))
+    automaton.make_automaton()
+    return automaton
+
+def swap_names(automaton:ahocorasick.Automaton, text:str) -> str:
+    """
+    Replaces all names held by a build_swap_automaton automaton in a single pass over the text.
+    Overlapping names resolve to the leftmost, then longest, match, same as a longest first regex alternation would.
+    The automaton's own iter_long can't be used for that, it misses matches starting inside a longer partial match.
+    """
+    # Longest name found at each starting position.
+    longest:dict[int, tuple[str, str]] = {}
+    for end, (source, target) in automaton.iter(text):
+        start = end - len(source) + 1
+        if start not in longest or len(source) > len(longest[start][0]):
+            longest[start] = (source, target)
+
+    parts:list[str] = []
+    last = 0
+    for start in sorted(longest):
+        if start < last:
+            continue
+        source, target = longest[start]
+        parts.append(text[last:start])
+        parts.append(target)
+        last = start + len(source)
+    parts.append(text[last:])
+    return "".join(parts)
+
+def cleanup_file(file:str, remove_re:re.Pattern|None, swap_automaton:ahocorasick.Automaton|None, swap_filenames:bool) -> str:
+    """
+    Applies the cleanup command's content removal and name swaps to a single file.
+    Returns the path the file should be renamed to, see rename_file, which is the file itself if it keeps its name.
+    """
+    newfile = file
+    text = read_text(file)
 
-        if not os.path.isdir(f"{db_stg_dir}\\migrations"):
-            os.makedirs(f"{db_stg_dir}\\migrations")
+    if remove_re:
+        text = remove_re.sub("", text)
+    if swap_automaton:
+        text = swap_names(swap_automaton, text)
+        if swap_filenames:
+            newfile = swap_names(swap_automaton, newfile)
 
+    write_text(file, text)
+    return newfile
+
+def rename_file(file:str, newfile:str, overwrite:bool):
+    """
+    Moves a cleaned up file to its new path, deleting any file already there when overwriting.
+    """
+    newfile_dir = newfile.rsplit('\\', 1)[0]
+    os.makedirs(newfile_dir, exist_ok=True)
+    if overwrite and os.path.isfile(newfile):
+        os.remove(newfile)
+    os.rename(file, newfile)
+
+def fast_move(source:str, target:str):
+    """
+    Moves a file with a single rename, metadata only. When source and target live in different volumes, which neither
+    renames nor hardlinks can cross, it falls back to shutil's in-kernel copy (sendfile and alike) and an unlink.
+    """
+    try:
+        os.replace(source, target)
+    except OSError as exc:
+        if exc.errno != errno.EXDEV:
+            raise
+        _ = shutil.copy2(source, target)
+        os.unlink(source)
+
+def remove_tree_async(path:str) -> threading.Thread|None:
+    """
+    Renames a directory out of the way, then deletes it in a background thread, so its path can be reused at once.
+    Returns the deleting thread (None if there was nothing to delete), which should be joined before exiting.
+    """
+    if not os.path.isdir(path):
+        return None
+    parent, name = os.path.split(path)
+    trash_dir = tempfile.mkdtemp(prefix=f".{name}.trash-", dir=parent)
+    os.replace(path, os.path.join(trash_dir, name))
+    thread = threading.Thread(target=shutil.rmtree, args=(trash_dir,), kwargs={"ignore_errors": True})
+    thread.start()
+    return thread
+
+def move_files(entries, source_dir:str, target_dir:str):
+    """
+    Moves the files of an iter_files walk over source_dir to the same relative paths under target_dir.
+    """
+    target_dirs:set[str] = set()
+    for entry in entries:
+        target = target_dir + entry.path[len(source_dir):]
+        target_parent = os.path.dirname(target)
+        if target_parent not in target_dirs:
+            os.makedirs(target_parent, exist_ok=True)
+            target_dirs.add(target_parent)
+        fast_move(entry.path, target)
+
+def script_source(source:str, base_dir:str, generate_creation_migrations:bool, overwrite:bool):
+    """
+    Scripts the schema (and optionally the creation migration) of a single "[server].[database]" source.
+    Runs in its own process when called from from_db, every source gets its own staging directory.
+    The schema is scripted next to its final directory, so it can be swapped in (or merged into it) by renaming.
+    """
+    source_server, source_db    = source.strip("[").strip("]").split("].[")
+    schema_base_dir        = f"{base_dir}\\schema\\{source_server}\\{source_db}"
+    schema_stg_dir         = f"{schema_base_dir}.stg"
+
+    # Leftovers of a previous run get deleted while scripting, joined on the way out as worker processes won't wait.
+    cleanups = [remove_tree_async(schema_stg_dir)]
+    try:
         if generate_creation_migrations:
-            current_migration      = slugify(fr"{datetime.now().strftime("%Y%m%d%H%M%S")}-{source_db} creation script")
+            os.makedirs(f"{base_dir}\\migrations", exist_ok=True)
+            # Sources are scripted at the same time, the server keeps same named databases from sharing a migration file.
+            current_migration      = slugify(fr"{datetime.now().strftime("%Y%m%d%H%M%S")}-{source_server}-{source_db} creation script")
             print(fr"Scripting initial schema creation for {source}...")
             scripter.main([
                 "--connection-string", fr"Server={source_server};Database={source_db};Trusted_Connection=yes;",
-                "-f", f"{db_stg_dir}\\migrations\\{current_migration}.sql",
+                "-f", f"{base_dir}\\migrations\\{current_migration}.sql",
                 "--script-create",
                 #"--change-tracking",
                 "--exclude-headers",
@@ -78,7 +695,7 @@ def from_db(sources: list[str], generate_creation_migrations:bool=False, overwri
         print(fr"Scripting schema layout for {source}...")
         scripter.main([
             "--connection-string", fr"Server={source_server};Database={source_db};Trusted_Connection=yes;",
-            "-f", f"{db_stg_dir}\\schema\\{source_server}\\{source_db}",
+            "-f", schema_stg_dir,
             "--file-per-object",
             "--script-create",
             #"--change-tracking",
@@ -87,27 +704,57 @@ def from_db(sources: list[str], generate_creation_migrations:bool=False, overwri
             #"--display-progress",
         ])
 
-            
-        schema_base_dir = f"{base_dir}\\schema\\{source_server}\\{source_db}"
-        if overwrite:
+        if not os.path.isdir(schema_stg_dir):
+            print(fr"Nothing was scripted for {source}, leaving {schema_base_dir} untouched...")
+        elif not os.path.isdir(schema_base_dir):
+            os.makedirs(os.path.dirname(schema_base_dir), exist_ok=True)
+            os.replace(schema_stg_dir, schema_base_dir)
+        elif overwrite:
             print(fr"Overwriting existing files at {schema_base_dir}...")
-            if os.path.isdir(schema_base_dir):
-                for root, _, files in os.walk(schema_base_dir):
-                    for file in files:
-                        if file.endswith(".sql"):
-                            os.remove(os.path.join(root, file))
-
-        print(fr"Moving files out of \.stg...")
-        for root, _, files in os.walk(db_stg_dir):
-            for file in files:
-                target_dir = root.replace(db_stg_dir,"")
-                full_target_dir = fr"{base_dir}\{target_dir}"
-                if not os.path.isdir(full_target_dir):
-                    os.makedirs(full_target_dir)
-                shutil.move(os.path.join(root, file), os.path.join(full_target_dir, file))
+            schema_bak_dir = f"{schema_base_dir}.bak"
+            cleanups.append(remove_tree_async(schema_bak_dir))
+            os.replace(schema_base_dir, schema_bak_dir)
+            os.replace(schema_stg_dir, schema_base_dir)
+            # Only schema scripts get overwritten, anything else in the old directory is kept.
+            move_files((entry for entry in iter_files(schema_bak_dir) if not entry.name.endswith(".sql")), schema_bak_dir, schema_base_dir)
+            cleanups.append(remove_tree_async(schema_bak_dir))
+        else:
+            print(fr"Moving files out of {schema_stg_dir}...")
+            move_files(iter_files(schema_stg_dir), schema_stg_dir, schema_base_dir)
+            cleanups.append(remove_tree_async(schema_stg_dir))
+    finally:
+        for cleanup in cleanups:
+            if cleanup:
+                cleanup.join()
+
+@click.group()
+def cli():
+    pass
+
+@cli.command()
+@click.option('-s', '--sources', type=str, help='List of source adresses in a [server].[database] format.', multiple=True)
+@click.option('-g', '--generate_creation_migrations', type=bool, help='If a database creation script sould be created in the migrations folder.', default=False)
+@click.option('-o', '--overwrite', type=bool, help='If existing schema scripts should be replaced by the newly generated ones', default=False)
+@click.option('-d', '--base_dir', type=str, help='Directory where the schema and migrations should reside. Current working dir by default.', default='')
+def from_db(sources: list[str], generate_creation_migrations:bool=False, overwrite:bool=False, base_dir:str=""):
+    """
+    Generates the database schema for each of the "[server].[database]" items passed to the function.
+    Optionally also generates the inital database creation script in the migrations folder.
+    """
+    #TODO: Add a file creation order marker to filenames, as it's relevant to the execution order when spawning DBs from the scripted schemas.
+    #TODO: Make it so the creation order marks are base os file contents and proper dependency tracking.
+
+    # Repeated sources would be scripted twice at once into the same files.
+    sources = list(dict.fromkeys(sources))
     
-        if os.path.isdir(db_stg_dir):
-            shutil.rmtree(db_stg_dir)
+    if not base_dir:
+        base_dir = os.getcwd()
+
+    if not sources:
+        return
+
+    with ProcessPoolExecutor(max_workers=min(len(sources), os.cpu_count() or 1)) as executor:
+        _ = list(executor.map(partial(script_source, base_dir=base_dir, generate_creation_migrations=generate_creation_migrations, overwrite=overwrite), sources))
 
 
 @cli.command()
@@ -123,25 +770,32 @@ def migration_to_db(target_server:str, target_migrations: list[str], base_dir:st
     if not base_dir:
         base_dir = os.getcwd()
 
-    for target in target_migrations:
-        sql_conn_str           = fr"Driver={{{[x for x in pyodbc.drivers() if x.endswith('SQL Server')][0]}}}; Server={target_server};Database=master;Trusted_Connection=yes;"
-        sql_conn_url           = sql.engine.URL.create("mssql+pyodbc", query={"odbc_connect": sql_conn_str})        
-        sql_engine             = sql.create_engine(sql_conn_url, connect_args = {"autocommit":True})
+    sql_engine             = create_sql_engine(target_server, autocommit=False)
 
-        print(fr"Trying to connect to {target_server}...")
+    paths = [f"{base_dir}\\migrations\\{target}.sql" for target in target_migrations]
 
-        with open(f"{base_dir}\\migrations\\{target}.sql", "r", encoding="utf-8") as f:
-            batches = re.split(r"(?<=)GO\n", f.read())[:-1]
+    print(fr"Trying to connect to {target_server}...")
+    # Scripts are read and split from a background thread while the previous batches are being executed.
+    items = prefetch(iter_migration_batches(paths))
+    with sql_engine.connect() as connection:
+        # Only script headers reach the loop itself, take_script consumes the rest of each script from the same stream.
+        for i, autocommit in items:
+            target  = target_migrations[i]
+            batches = take_script(items)
 
-        with sql_engine.connect() as connection:
-            print(fr"Executing {len(batches)} batches...")
-            for i, batch in enumerate(batches):
-                try:
-                    _ = connection.execute(sql.text(batch))
-                    #print(fr"GO - - - > Batch {i+1}/{len(batches)} OK!")
-                except Exception as exc:
-                    print(fr"Failed on batch {i+1}/{len(batches)}!")
-                    print(exc)
+            if autocommit:
+                print(fr"Executing batches from {target}, outside of a transaction as it holds database level statements...")
+                _ = connection.execution_options(isolation_level="AUTOCOMMIT")
+                _ = execute_batches(connection, batches, paths[i])
+                _ = connection.execution_options(isolation_level=connection.default_isolation_level)
+                continue
+
+            print(fr"Executing batches from {target} in a single transaction...")
+            try:
+                with connection.begin():
+                    _ = execute_batches(connection, batches, paths[i], transactional=True)
+            except Exception as exc:
+                raise click.ClickException(f"Rolled back {target}, the remaining migrations won't be executed.\n{exc}") from exc
 
 
 @cli.command()
@@ -152,38 +806,24 @@ def schema_to_db(target_addresses: list[str], overwrite:bool = False, base_dir:s
     """
     Runs a list of schema creations scripts against the chosen server."
     """
-    #TODO: Follow proper creation order based on dependencies.
-    
     if not base_dir:
         base_dir = os.getcwd()
 
-    for target in target_addresses:
-        target_server, target_db    = target.strip("[").strip("]").split("].[")
-        sql_conn_str           = fr"Driver={{{[x for x in pyodbc.drivers() if x.endswith('SQL Server')][0]}}}; Server={target_server};Database=master;Trusted_Connection=yes;"
-        sql_conn_url           = sql.engine.URL.create("mssql+pyodbc", query={"odbc_connect": sql_conn_str})        
-        sql_engine             = sql.create_engine(sql_conn_url, connect_args = {"autocommit":True})
-
-        print(fr"Trying to connect to {target_server}...")
-
-        for root, _, files in os.walk(f"{base_dir}\\schema\\{target_server}\\{target_db}"):
-            for file in files:
-                with open(os.path.join(root, file), "r", encoding="utf-8") as f:
-                    batches = re.split(r"(?<=)GO\n", f.read())[:-1]
-                
-                with sql_engine.connect() as connection:
-                    print(fr"Preparing to execute migration scripts...")
-                    if overwrite:
-                        print(fr"Dropping [{target_db}] if it already exists...")
-                        _ = connection.execute(sql.text(fr"DROP DATABASE IF EXISTS [{target_db}];"))
-
-                    print(fr"Executing {len(batches)} batches...")
-                    for i, batch in enumerate(batches):
-                        try:
-                            _ = connection.execute(sql.text(batch))
-                            #print(fr"GO - - - > Batch {i+1}/{len(batches)} OK!")
-                        except Exception as exc:
-                            print(fr"Failed on batch {i+1}/{len(batches)}!")
-                            print(exc)
+    if not target_addresses:
+        return
+
+    # One engine per server, shared by all of its targets.
+    servers = [target.strip("[").strip("]").split("].[")[0] for target in target_addresses]
+    sql_engines = {server: create_sql_engine(server, pool_size=SCHEMA_WORKERS * servers.count(server)) for server in set(servers)}
+
+    with ThreadPoolExecutor(max_workers=len(target_addresses)) as executor:
+        failed = dict(zip(target_addresses, executor.map(lambda target, server: apply_schema_target(sql_engines[server], target, overwrite, base_dir), target_addresses, servers)))
+
+    for sql_engine in sql_engines.values():
+        sql_engine.dispose()
+
+    if any(failed.values()):
+        raise click.ClickException("Some schema batches failed: " + ", ".join(fr"{count} on {target}" for target, count in failed.items() if count))
 
 
 @cli.command()
@@ -208,13 +848,14 @@ def new_blank(name:str, base_dir:str=""):
 @click.option('-s', '--name_swaps', type=(str, str), help='Dictionary of words to be replaced.', multiple=True)
 @click.option('-rr','--regex_remove', type=str, help='Remove contents based on regex match.', default='')
 @click.option('-sf','--swap_filenames', type=bool, help='If filenames should be affected by --name_swaps.', default=True)
-@click.option('-re','--remove_empty_dirs', type=bool, help='If empty directories should be removed.', default=True)
+@click.option('-re','--remove_empty_dirs', type=bool, help='If directories left empty by renamed files should be removed.', default=True)
 @click.option('-o', '--overwrite', type=bool, help='If a file is renamed to the path of an exisiting file, it will be deleted.', default=False)
 @click.option('-d', '--base_dir', type=str, help='Directory where the schema and migrations reside. Current working dir by default.', default='')
 def cleanup(target_files:str, name_swaps:dict[str, str], regex_remove:str, swap_filenames:bool=True, remove_empty_dirs:bool=True, base_dir:str="", overwrite:bool=False):
     """
     General cleanup utility function.
-    Makes sure the entire folder (schemas and migrations) follow the desired encoding, object names, and no empty unused directories.
+    Makes sure the entire folder (schemas and migrations) follow the desired encoding and object names, removing the directories
+    emptied by renamed files. Empty directories the cleanup didn't touch are left alone.
     Also allows for easy object renaming/remapping.
     """
 
@@ -227,44 +868,59 @@ def cleanup(target_files:str, name_swaps:dict[str, str], regex_remove:str, swap_
     if not os.path.isabs(target_files):
         target_files = os.path.join(base_dir, target_files)
 
+    remove_re = re.compile(regex_remove, re.MULTILINE) if regex_remove else None
+    swap_automaton = build_swap_automaton(name_swaps) if any(name_swaps) else None
+
     files = glob(target_files, recursive=True)
     print(fr"Cleaning up {len(files)} files matching to {target_files}...")
+    # A failed rewrite doesn't stop the others, as workers already running can't be stopped halfway anyway. Every file
+    # ends up either untouched, or rewritten and renamed, never rewritten under its old name because of another failure.
+    newfiles:dict[str, str] = {}
+    failed_rewrites:list[str] = []
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+        futures = [executor.submit(cleanup_file, file, remove_re, swap_automaton, swap_filenames) for file in files]
+        for i, (file, future) in enumerate(zip(files, futures)):
+            try:
+                newfiles[file] = future.result()
+            except Exception as exc:
+                print(fr"Got error while cleaning up file {i}/{len(files)} at {file}, it was left untouched...")
+                print(exc)
+                failed_rewrites.append(file)
+
+    # Renames wait for every rewrite and go in glob order, a file can't be moved onto another one still being rewritten.
+    failed_renames:list[str] = []
+    dir_live:dict[str, int] = defaultdict(int)
     for i, file in enumerate(files):
-        newfile = file
+        if file not in newfiles:
+            continue
+        newfile = newfiles[file]
         try:
-            with open(file, "r", encoding="utf-8") as f:
-                text = f.read()
+            if file != newfile:
+                rename_file(file, newfile, overwrite)
         except Exception as exc:
-            print(fr"Got error while cleaning up file {i}/{len(files)} at {file}...")
+            print(fr"Got error while renaming file {i}/{len(files)} at {file} to {newfile}, it was cleaned up but kept its name...")
             print(exc)
-            return
-
-        text = re.sub(regex_remove, "", text, flags=re.MULTILINE)
-        for source, target in name_swaps.items():
-            text = text.replace(source, target)
-            if swap_filenames:
-                newfile = newfile.replace(source, target)
-
-        with open(file, "w", encoding="utf-8") as f:
-            _ = f.write(text)
-
-        if swap_filenames and file != newfile:
-            newfile_dir = newfile.rsplit('\\', 1)[0]
-            if not os.path.isdir(newfile_dir):
-                os.makedirs(newfile_dir)
-            if overwrite and os.path.isfile(newfile):
-                os.remove(newfile)
-            os.rename(file, newfile)
+            failed_renames.append(file)
+            newfile = file
+        dir_live[os.path.abspath(os.path.dirname(file))]    += 0
+        dir_live[os.path.abspath(os.path.dirname(newfile))] += 1
 
     if remove_empty_dirs:
-        deleted:set[str] = set()
-        for current_dir, subdirs, files in os.walk(base_dir, topdown=False):
-            still_has_subdirs = False
-            for subdir in subdirs:
-                if os.path.join(current_dir, subdir) not in deleted:
-                    still_has_subdirs = True
-                    break
-            if not any(files) and not still_has_subdirs:
+        # Only directories a file was renamed out of can have been emptied; any ancestor still holding a file stops the climb
+        base_dir = os.path.abspath(base_dir)
+        candidates:set[str] = set()
+        for current_dir, live in dir_live.items():
+            while not live and current_dir not in candidates and current_dir.startswith(base_dir + os.sep):
+                candidates.add(current_dir)
+                current_dir = os.path.dirname(current_dir)
+                live        = dir_live.get(current_dir, 0)
+
+        for current_dir in sorted(candidates, key=lambda path: path.count(os.sep), reverse=True):
+            try:
                 os.rmdir(current_dir)
-                deleted.add(current_dir)
+            except OSError:
+                pass  # Still holds files this run didn't touch or subdirs that weren't emptied
 
+    if failed_rewrites or failed_renames:
+        report = [fr"Left untouched: {file}" for file in failed_rewrites] + [fr"Cleaned up but not renamed: {file}" for file in failed_renames]
+        raise click.ClickException("Some files couldn't be fully cleaned up.\n" + "\n".join(report))
@@ -0,0 +1,35 @@
+import time
+
+import pytest
+
+from chronoschema import parse_seed_insert
+
+
+def test_parse_seed_insert_rows():
+    batch = "INSERT INTO [dbo].[T] ([a], [b], [c]) VALUES (1, N'it''s', NULL), (-2.5, 'x', 1E-3)\n"
+    batch += "INSERT INTO [dbo].[T] ([a], [b], [c]) VALUES (.5, '', 3.);\n"
+    assert parse_seed_insert(batch) == (
+        "INSERT INTO [dbo].[T] ([a],[b],[c]) VALUES (?,?,?)",
+        [("1", "it's", None), ("-2.5", "x", "1E-3"), (".5", "", "3.")],
+    )
+
+
+@pytest.mark.parametrize("batch", [
+    "UPDATE [dbo].[T] SET [a] = 1",
+    "INSERT INTO [dbo].[T] ([a], [b]) VALUES (1, GETDATE())",
+    "INSERT INTO [dbo].[T] ([a], [b]) VALUES (1)",
+    "INSERT INTO [dbo].[T] ([a]) VALUES (1)\nINSERT INTO [dbo].[U] ([a]) VALUES (1)",
+])
+def test_parse_seed_insert_rejects(batch):
+    assert parse_seed_insert(batch) is None
+
+
+@pytest.mark.parametrize("values", [
+    ", ".join(["100001"] * 10) + ", GETDATE()",
+    ", ".join(["12345678"] * 12) + ", NEWID()",
+])
+def test_parse_seed_insert_fails_fast_on_non_literal_rows(values):
+    columns = ", ".join(f"[c{i}]" for i in range(values.count(",") + 1))
+    start = time.perf_counter()
+    assert parse_seed_insert(f"INSERT INTO [dbo].[T] ({columns}) VALUES ({values})") is None
+    assert time.perf_counter() - start < 1
@@ -0,0 +1,34 @@
+import random
+import re
+
+import pytest
+
+from chronoschema import build_swap_automaton, swap_names
+
+
+def swap_names_reference(name_swaps:dict[str, str], text:str) -> str:
+    """
+    Longest first regex alternation, as cleanup used to swap names before the automaton.
+    """
+    swap_re = re.compile("|".join(map(re.escape, sorted(name_swaps, key=len, reverse=True))))
+    return swap_re.sub(lambda match: name_swaps[match.group(0)], text)
+
+
+@pytest.mark.parametrize("name_swaps, text, expected", [
+    ({"Order": "Ord", "OrderOrderLine": "L"}, "[OrderOrder] Order", "[OrdOrd] Ord"),
+    ({"Order": "Ord", "OrderOrderLine": "L"}, "[OrderOrderLine] Order", "[L] Ord"),
+    ({"a": "Y", "aaa": "X"}, "acaa", "YcYY"),
+    ({"a": "Y", "aaa": "X"}, "aaaa", "XY"),
+    ({"dbo": "sales", "Orders": "Sales"}, "[dbo].[Orders]", "[sales].[Sales]"),
+])
+def test_swap_names_prefix_overlaps(name_swaps, text, expected):
+    assert swap_names(build_swap_automaton(name_swaps), text) == expected
+    assert swap_names_reference(name_swaps, text) == expected
+
+
+def test_swap_names_matches_regex_reference():
+    rnd = random.Random(0)
+    for _ in range(5000):
+        name_swaps = {"".join(rnd.choices("abc", k=rnd.randint(1, 4))): rnd.choice(["X", "Y", "", "zz"]) for _ in range(rnd.randint(1, 4))}
+        text = "".join(rnd.choices("abcd", k=rnd.randint(0, 20)))
+        assert swap_names(build_swap_automaton(name_swaps), text) == swap_names_reference(name_swaps, text), (name_swaps, text)
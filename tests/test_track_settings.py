@@ -0,0 +1,35 @@
+import time
+
+from chronoschema import track_settings
+
+
+def test_track_settings_skips_repeated_options():
+    settings = {}
+    assert not track_settings(settings, "SET ANSI_NULLS ON\r\n")
+    assert not track_settings(settings, "SET QUOTED_IDENTIFIER ON\r\n")
+    assert not track_settings(settings, "CREATE TABLE [dbo].[T] ([a] int)\r\n")
+    assert track_settings(settings, "SET ANSI_NULLS ON\r\n")
+    assert track_settings(settings, "SET ANSI_NULLS, QUOTED_IDENTIFIER ON;\r\n")
+    assert not track_settings(settings, "SET ANSI_NULLS OFF\r\n")
+
+
+def test_track_settings_forgets_options_changed_by_compound_ones():
+    settings = {}
+    assert not track_settings(settings, "SET ANSI_NULLS ON\r\n")
+    assert not track_settings(settings, "SET ANSI_DEFAULTS OFF\r\n")
+    assert not track_settings(settings, "SET ANSI_NULLS ON\r\n")
+    assert track_settings(settings, "SET ANSI_NULLS ON\r\n")
+
+
+def test_track_settings_forgets_options_set_alongside_other_statements():
+    settings = {}
+    assert not track_settings(settings, "SET ANSI_NULLS ON\r\n")
+    assert not track_settings(settings, "SET ANSI_NULLS OFF\r\nUPDATE [dbo].[T] SET [a] = 1\r\n")
+    assert not track_settings(settings, "SET ANSI_NULLS ON\r\n")
+
+
+def test_track_settings_fails_fast_on_long_option_runs():
+    settings = {}
+    start = time.perf_counter()
+    assert not track_settings(settings, "SET NOCOUNT ON\r\n" * 40 + "UPDATE [dbo].[T] SET [a] = 1\r\n")
+    assert time.perf_counter() - start < 1